@@ -1,8 +1,11 @@
 from __future__ import annotations
-import os, time, uuid, shutil
+import os, time, uuid
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
+from app.utils import fast_rmtree, forget_tree, invalidate_tree
+
 JOB_ROOT = Path(os.environ.get("JOB_ROOT", "/tmp/renpy-web-tool-jobs")).resolve()
 JOB_ROOT.mkdir(parents=True, exist_ok=True)
 
@@ -16,6 +19,7 @@ class JobPaths:
     out: Path
     meta: Path
 
+@lru_cache(maxsize=1024)
 def job_paths(job_id: str) -> JobPaths:
     root = (JOB_ROOT / job_id).resolve()
     return JobPaths(root=root, inp=root/"input", out=root/"output", meta=root/"meta.json")
@@ -28,8 +32,11 @@ def new_job() -> str:
     touch_meta(job_id)
     return job_id
 
-def touch_meta(job_id: str) -> None:
+def touch_meta(job_id: str, dirty: bool = False) -> None:
     jp = job_paths(job_id)
+    if dirty:
+        invalidate_tree(jp.inp)
+        invalidate_tree(jp.out)
     if jp.meta.exists():
         os.utime(jp.meta, None)
     else:
@@ -38,13 +45,21 @@ def touch_meta(job_id: str) -> None:
 def cleanup_jobs(ttl_seconds: int) -> int:
     removed = 0
     cutoff = now_s() - ttl_seconds
-    for job_dir in JOB_ROOT.iterdir():
-        try:
-            meta = job_dir / "meta.json"
-            ts = int(meta.stat().st_mtime) if meta.exists() else int(job_dir.stat().st_mtime)
-            if ts < cutoff:
-                shutil.rmtree(job_dir, ignore_errors=True)
-                removed += 1
-        except Exception:
-            continue
+    with os.scandir(JOB_ROOT) as it:
+        for entry in it:
+            try:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    ts = int(os.stat(os.path.join(entry.path, "meta.json")).st_mtime)
+                except FileNotFoundError:
+                    ts = int(entry.stat(follow_symlinks=False).st_mtime)
+                if ts < cutoff:
+                    job_dir = Path(entry.path)
+                    forget_tree(job_dir / "input")
+                    forget_tree(job_dir / "output")
+                    fast_rmtree(job_dir)
+                    removed += 1
+            except Exception:
+                continue
     return removed
@@ -4,12 +4,14 @@ import asyncio
 import mimetypes
 import os
 import shutil
+import zipfile
 from pathlib import Path
 from typing import List, Literal, Optional
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Body, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
 from app.jobs import cleanup_jobs, job_paths, new_job, touch_meta
@@ -17,7 +19,12 @@ from app.utils import (
     ensure_safe_relpath,
     ensure_safe_relpath_allow_empty,
     extract_zip,
+    fast_rmtree,
+    file_etag,
     is_zip_path,
+    iter_tar_zst,
+    iter_zip,
+    tree_etag,
     walk_tree,
 )
 from app.processors.decompile import decompile_rpyc_files
@@ -27,6 +34,7 @@ from app.processors.pack import pack_rpa_from_dir
 APP_NAME = "VNTl RenPy Compiler"
 JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
 MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "200"))
+BINARY_MIME_PREFIXES = ("image/", "audio/", "video/", "application/octet-stream")
 
 app = FastAPI(title=APP_NAME)
 
@@ -76,11 +84,27 @@ class RepackRequest(BaseModel):
 async def _periodic_cleanup():
     while True:
         try:
-            cleanup_jobs(JOB_TTL_SECONDS)
+            await asyncio.to_thread(cleanup_jobs, JOB_TTL_SECONDS)
         except Exception:
             pass
         await asyncio.sleep(300)
 
+def _save_upload(src, dest: Path) -> int:
+    with dest.open("wb") as out:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(out.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        shutil.copyfileobj(src, out, length=1024 * 1024)
+        return os.fstat(out.fileno()).st_size
+
+def _cache_headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": "private, must-revalidate"}
+
+def _not_modified(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    return inm.strip() == "*" or etag in (t.strip() for t in inm.split(","))
+
 @app.on_event("startup")
 async def on_startup():
     asyncio.create_task(_periodic_cleanup())
@@ -94,6 +118,7 @@ async def create_job(files: List[UploadFile] = File(...)):
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
 
+    max_bytes = MAX_UPLOAD_MB * 1024 * 1024
     job_id = new_job()
     jp = job_paths(job_id)
 
@@ -107,34 +132,32 @@ async def create_job(files: List[UploadFile] = File(...)):
         dest = jp.inp / safe_name
         dest.parent.mkdir(parents=True, exist_ok=True)
 
-        with dest.open("wb") as out:
-            while True:
-                chunk = await f.read(1024 * 1024)
-                if not chunk:
-                    break
-                total += len(chunk)
-                if total > MAX_UPLOAD_MB * 1024 * 1024:
-                    raise HTTPException(status_code=413, detail=f"Upload too large (>{MAX_UPLOAD_MB}MB)")
-                out.write(chunk)
+        total += await run_in_threadpool(_save_upload, f.file, dest)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload too large (>{MAX_UPLOAD_MB}MB)")
 
         if is_zip_path(dest):
-            extract_zip(dest, jp.inp)
+            await asyncio.to_thread(extract_zip, dest, jp.inp)
             dest.unlink(missing_ok=True)
 
-    touch_meta(job_id)
-    return JobCreateResponse(job_id=job_id, input_tree=walk_tree(jp.inp))
+    touch_meta(job_id, dirty=True)
+    return JobCreateResponse(job_id=job_id, input_tree=await asyncio.to_thread(walk_tree, jp.inp))
 
 @app.get("/api/jobs/{job_id}/tree")
-def job_tree(job_id: str, where: Literal["input", "output"] = "output"):
+def job_tree(job_id: str, request: Request, where: Literal["input", "output"] = "output"):
     jp = job_paths(job_id)
     root = jp.out if where == "output" else jp.inp
     if not root.exists():
         raise HTTPException(status_code=404, detail="Job not found")
     touch_meta(job_id)
-    return {"job_id": job_id, "where": where, "tree": walk_tree(root)}
+
+    headers = _cache_headers(tree_etag(root))
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"job_id": job_id, "where": where, "tree": walk_tree(root)}, headers=headers)
 
 @app.post("/api/jobs/{job_id}/process", response_model=ProcessResponse)
-def process_job(
+async def process_job(
     job_id: str,
     mode: Literal["auto", "decompile", "extract_rpa", "extract_rpi", "pack_rpa"] = Query("auto"),
     try_harder: bool = Query(False),
@@ -150,91 +173,134 @@ def process_job(
     if not jp.root.exists():
         raise HTTPException(status_code=404, detail="Job not found")
 
-    if jp.out.exists():
-        shutil.rmtree(jp.out, ignore_errors=True)
-    jp.out.mkdir(parents=True, exist_ok=True)
+    return await asyncio.to_thread(
+        _run_process,
+        job_id,
+        mode,
+        try_harder=try_harder,
+        pack_source_where=pack_source_where,
+        pack_source_path=pack_source_path,
+        pack_name=pack_name,
+        pack_version=pack_version,
+        pack_key_hex=pack_key_hex,
+        pack_padding=pack_padding,
+    )
 
-    logs: list[str] = []
-    touch_meta(job_id)
+def _run_process(
+    job_id: str,
+    mode: str,
+    try_harder: bool,
+    pack_source_where: str,
+    pack_source_path: str,
+    pack_name: str,
+    pack_version: int,
+    pack_key_hex: str,
+    pack_padding: int,
+) -> ProcessResponse:
+    jp = job_paths(job_id)
 
-    rpyc_files = list(jp.inp.rglob("*.rpyc"))
-    rpa_files = list(jp.inp.rglob("*.rpa"))
-    rpi_files = list(jp.inp.rglob("*.rpi"))
+    try:
+        if jp.out.exists():
+            fast_rmtree(jp.out)
+        jp.out.mkdir(parents=True, exist_ok=True)
+
+        logs: list[str] = []
+        touch_meta(job_id)
+
+        rpyc_files: list[Path] = []
+        rpa_files: list[Path] = []
+        rpi_files: list[Path] = []
+        by_ext = {"rpyc": rpyc_files, "rpa": rpa_files, "rpi": rpi_files}
+        for dirpath, _, names in os.walk(jp.inp):
+            for name in names:
+                bucket = by_ext.get(name.rpartition(".")[2].lower()) if "." in name else None
+                if bucket is not None:
+                    bucket.append(Path(dirpath) / name)
+
+        if mode in ("auto", "decompile"):
+            if rpyc_files:
+                _, l = decompile_rpyc_files(rpyc_files, jp.out, try_harder=try_harder)
+                logs.extend(l)
+            else:
+                logs.append("[decompile] No .rpyc files found.")
+
+        if mode in ("auto", "extract_rpa"):
+            if rpa_files:
+                _, l = extract_rpa_with_unrpa(rpa_files, jp.out)
+                logs.extend(l)
+            else:
+                logs.append("[extract_rpa] No .rpa files found.")
+
+        if mode in ("auto", "extract_rpi"):
+            if rpi_files:
+                _, l = extract_rpi_with_rpatool(rpi_files, jp.inp, jp.out)
+                logs.extend(l)
+            else:
+                logs.append("[extract_rpi] No .rpi files found.")
+
+        if mode in ("auto", "pack_rpa"):
+            base = jp.inp if pack_source_where == "input" else jp.out
+            rel = ensure_safe_relpath_allow_empty(pack_source_path)
+            source_dir = (base / rel).resolve()
+            if not source_dir.is_relative_to(base):
+                raise HTTPException(status_code=400, detail="Invalid pack_source_path")
+            out_path, l = pack_rpa_from_dir(
+                source_dir=source_dir,
+                out_dir=jp.out,
+                archive_name=pack_name,
+                version=pack_version,
+                key_hex=pack_key_hex,
+                padding=pack_padding,
+            )
+            logs.extend(l)
+            if out_path:
+                logs.append(f"[pack] created: {out_path.name}")
+    finally:
+        touch_meta(job_id, dirty=True)
 
-    if mode in ("auto", "decompile"):
-        if rpyc_files:
-            _, l = decompile_rpyc_files(rpyc_files, jp.out, try_harder=try_harder)
-            logs += l
-        else:
-            logs.append("[decompile] No .rpyc files found.")
+    return ProcessResponse(job_id=job_id, mode=mode, output_tree=walk_tree(jp.out), logs=logs)
 
-    if mode in ("auto", "extract_rpa"):
-        if rpa_files:
-            _, l = extract_rpa_with_unrpa(rpa_files, jp.out)
-            logs += l
-        else:
-            logs.append("[extract_rpa] No .rpa files found.")
+@app.post("/api/jobs/{job_id}/repack", response_model=ProcessResponse)
+async def repack_job(job_id: str, payload: RepackRequest = Body(...)):
+    jp = job_paths(job_id)
+    if not jp.root.exists():
+        raise HTTPException(status_code=404, detail="Job not found")
 
-    if mode in ("auto", "extract_rpi"):
-        if rpi_files:
-            _, l = extract_rpi_with_rpatool(rpi_files, jp.inp, jp.out)
-            logs += l
-        else:
-            logs.append("[extract_rpi] No .rpi files found.")
+    return await asyncio.to_thread(_run_repack, job_id, payload)
+
+def _run_repack(job_id: str, payload: RepackRequest) -> ProcessResponse:
+    jp = job_paths(job_id)
+    try:
+        jp.out.mkdir(parents=True, exist_ok=True)
+        logs: list[str] = []
+        touch_meta(job_id)
 
-    if mode in ("auto", "pack_rpa"):
-        base = jp.inp if pack_source_where == "input" else jp.out
-        rel = ensure_safe_relpath_allow_empty(pack_source_path)
+        base = jp.inp if payload.source_where == "input" else jp.out
+        rel = ensure_safe_relpath_allow_empty(payload.source_path)
         source_dir = (base / rel).resolve()
-        if not str(source_dir).startswith(str(base.resolve())):
-            raise HTTPException(status_code=400, detail="Invalid pack_source_path")
+        if not source_dir.is_relative_to(base):
+            raise HTTPException(status_code=400, detail="Invalid source_path")
+
         out_path, l = pack_rpa_from_dir(
             source_dir=source_dir,
             out_dir=jp.out,
-            archive_name=pack_name,
-            version=pack_version,
-            key_hex=pack_key_hex,
-            padding=pack_padding,
+            archive_name=payload.name,
+            version=payload.version,
+            key_hex=payload.key_hex,
+            padding=payload.padding,
         )
-        logs += l
+        logs.extend(l)
         if out_path:
-            logs.append(f"[pack] created: {out_path.name}")
-
-    return ProcessResponse(job_id=job_id, mode=mode, output_tree=walk_tree(jp.out), logs=logs)
-
-@app.post("/api/jobs/{job_id}/repack", response_model=ProcessResponse)
-def repack_job(job_id: str, payload: RepackRequest = Body(...)):
-    jp = job_paths(job_id)
-    if not jp.root.exists():
-        raise HTTPException(status_code=404, detail="Job not found")
-
-    jp.out.mkdir(parents=True, exist_ok=True)
-    logs: list[str] = []
-    touch_meta(job_id)
-
-    base = jp.inp if payload.source_where == "input" else jp.out
-    rel = ensure_safe_relpath_allow_empty(payload.source_path)
-    source_dir = (base / rel).resolve()
-    if not str(source_dir).startswith(str(base.resolve())):
-        raise HTTPException(status_code=400, detail="Invalid source_path")
-
-    out_path, l = pack_rpa_from_dir(
-        source_dir=source_dir,
-        out_dir=jp.out,
-        archive_name=payload.name,
-        version=payload.version,
-        key_hex=payload.key_hex,
-        padding=payload.padding,
-    )
-    logs += l
-    if out_path:
-        logs.append(f"[repack] created: {out_path.name}")
+            logs.append(f"[repack] created: {out_path.name}")
+    finally:
+        touch_meta(job_id, dirty=True)
 
     return ProcessResponse(job_id=job_id, mode="repack", output_tree=walk_tree(jp.out), logs=logs)
 
 @app.get("/api/jobs/{job_id}/file")
 def get_file(
     job_id: str,
+    request: Request,
     path: str = Query(...),
     where: Literal["input", "output"] = Query("output"),
     as_text: bool = Query(True),
@@ -246,27 +312,38 @@ def get_file(
 
     rel = ensure_safe_relpath(path)
     full = (root / rel).resolve()
-    if not str(full).startswith(str(root.resolve())) or not full.exists() or not full.is_file():
+    if not full.is_relative_to(root) or not full.is_file():
         raise HTTPException(status_code=404, detail="File not found")
 
     touch_meta(job_id)
 
-    if as_text:
-        if full.stat().st_size > 2 * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="File too large to preview")
-        data = full.read_bytes()
-        try:
-            text = data.decode("utf-8")
-        except UnicodeDecodeError:
-            text = data.decode("utf-8", errors="replace")
-        return PlainTextResponse(text)
+    st = full.stat()
+    headers = _cache_headers(file_etag(st))
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
 
     mime, _ = mimetypes.guess_type(full.name)
-    return FileResponse(full, media_type=mime or "application/octet-stream", filename=full.name)
+
+    if as_text:
+        if st.st_size > 2 * 1024 * 1024:
+            raise HTTPException(status_code=413, detail="File too large to preview")
+        if mime and mime.startswith(BINARY_MIME_PREFIXES):
+            raise HTTPException(status_code=415, detail="Binary file cannot be previewed as text")
+        text = full.read_bytes().decode("utf-8", "replace")
+        return PlainTextResponse(text, headers=headers)
+
+    return FileResponse(
+        full,
+        media_type=mime or "application/octet-stream",
+        filename=full.name,
+        headers=headers,
+        stat_result=st,
+    )
 
 @app.get("/api/jobs/{job_id}/raw")
 def get_raw(
     job_id: str,
+    request: Request,
     path: str = Query(...),
     where: Literal["input", "output"] = Query("output"),
 ):
@@ -277,12 +354,18 @@ def get_raw(
 
     rel = ensure_safe_relpath(path)
     full = (root / rel).resolve()
-    if not str(full).startswith(str(root.resolve())) or not full.exists() or not full.is_file():
+    if not full.is_relative_to(root) or not full.is_file():
         raise HTTPException(status_code=404, detail="File not found")
 
     touch_meta(job_id)
+
+    st = full.stat()
+    headers = _cache_headers(file_etag(st))
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
     mime, _ = mimetypes.guess_type(full.name)
-    return FileResponse(full, media_type=mime or "application/octet-stream")
+    return FileResponse(full, media_type=mime or "application/octet-stream", headers=headers, stat_result=st)
 
 @app.put("/api/jobs/{job_id}/file")
 def save_file(
@@ -296,14 +379,14 @@ def save_file(
 
     rel = ensure_safe_relpath(path)
     full = (root / rel).resolve()
-    if not str(full).startswith(str(root.resolve())) or not full.exists() or not full.is_file():
+    if not full.is_relative_to(root) or not full.is_file():
         raise HTTPException(status_code=404, detail="File not found")
 
     if len(payload.content.encode("utf-8")) > 2 * 1024 * 1024:
         raise HTTPException(status_code=413, detail="Content too large")
 
     full.write_text(payload.content, encoding="utf-8")
-    touch_meta(job_id)
+    touch_meta(job_id, dirty=True)
     return {"ok": True}
 
 @app.post("/api/jobs/{job_id}/fs/move")
@@ -319,12 +402,12 @@ def fs_move(job_id: str, payload: MoveRequest = Body(...)):
     src = (root / src_rel).resolve()
     dst = (root / dst_rel).resolve()
 
-    if not str(src).startswith(str(root.resolve())) or not src.exists():
+    if not src.is_relative_to(root) or not src.exists():
         raise HTTPException(status_code=404, detail="Source not found")
-    if not str(dst).startswith(str(root.resolve())):
+    if not dst.is_relative_to(root):
         raise HTTPException(status_code=400, detail="Invalid destination")
 
-    if src.is_dir() and str(dst).startswith(str(src)):
+    if src.is_dir() and dst.is_relative_to(src):
         raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
 
     dst.parent.mkdir(parents=True, exist_ok=True)
@@ -333,12 +416,12 @@ def fs_move(job_id: str, payload: MoveRequest = Body(...)):
         if not payload.overwrite:
             raise HTTPException(status_code=409, detail="Destination exists")
         if dst.is_dir():
-            shutil.rmtree(dst, ignore_errors=True)
+            fast_rmtree(dst)
         else:
             dst.unlink(missing_ok=True)
 
     shutil.move(str(src), str(dst))
-    touch_meta(job_id)
+    touch_meta(job_id, dirty=True)
     return {"ok": True}
 
 @app.post("/api/jobs/{job_id}/fs/mkdir")
@@ -349,10 +432,10 @@ def fs_mkdir(job_id: str, payload: MkdirRequest = Body(...)):
         raise HTTPException(status_code=404, detail="Job not found")
     rel = ensure_safe_relpath(payload.path)
     d = (root / rel).resolve()
-    if not str(d).startswith(str(root.resolve())):
+    if not d.is_relative_to(root):
         raise HTTPException(status_code=400, detail="Invalid path")
     d.mkdir(parents=True, exist_ok=True)
-    touch_meta(job_id)
+    touch_meta(job_id, dirty=True)
     return {"ok": True}
 
 @app.delete("/api/jobs/{job_id}/fs")
@@ -364,15 +447,18 @@ def fs_delete(job_id: str, where: Literal["input", "output"] = Query("output"),
 
     rel = ensure_safe_relpath(path)
     full = (root / rel).resolve()
-    if not str(full).startswith(str(root.resolve())) or not full.exists():
+    if not full.is_relative_to(root) or not full.exists():
         raise HTTPException(status_code=404, detail="Not found")
 
     if full.is_dir():
-        shutil.rmtree(full, ignore_errors=True)
+        fast_rmtree(full)
     else:
-        full.unlink(missing_ok=True)
+        try:
+            os.unlink(full)
+        except FileNotFoundError:
+            pass
 
-    touch_meta(job_id)
+    touch_meta(job_id, dirty=True)
     return {"ok": True}
 
 
@@ -381,6 +467,7 @@ def download(
     job_id: str,
     where: Literal["input", "output"] = Query("output"),
     zip_all: bool = Query(False, alias="zip"),
+    compress: Literal["store", "deflate", "zstd"] = Query("store"),
     path: Optional[str] = Query(None),
 ):
     jp = job_paths(job_id)
@@ -392,7 +479,7 @@ def download(
     if path:
         rel = ensure_safe_relpath(path)
         full = (root / rel).resolve()
-        if not str(full).startswith(str(root.resolve())) or not full.exists() or not full.is_file():
+        if not full.is_relative_to(root) or not full.is_file():
             raise HTTPException(status_code=404, detail="File not found")
         mime, _ = mimetypes.guess_type(full.name)
         return FileResponse(full, media_type=mime or "application/octet-stream", filename=full.name)
@@ -400,14 +487,19 @@ def download(
     if not zip_all:
         raise HTTPException(status_code=400, detail="Set zip=1 or provide path")
 
-    zip_path = jp.root / f"{where}.zip"
-    if zip_path.exists():
-        zip_path.unlink(missing_ok=True)
-
-    import zipfile
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for f in root.rglob("*"):
-            if f.is_file():
-                z.write(f, arcname=str(f.relative_to(root)).replace(os.sep, "/"))
+    if compress == "zstd":
+        try:
+            import pyzstd  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="zstd compression is not available")
+        return StreamingResponse(
+            iter_tar_zst(root),
+            media_type="application/zstd",
+            headers={"Content-Disposition": f'attachment; filename="{where}.tar.zst"'},
+        )
 
-    return FileResponse(zip_path, media_type="application/zip", filename=f"{where}.zip")
+    return StreamingResponse(
+        iter_zip(root, compression=zipfile.ZIP_DEFLATED if compress == "deflate" else zipfile.ZIP_STORED),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{where}.zip"'},
+    )
@@ -1,28 +1,84 @@
 from __future__ import annotations
+import multiprocessing, os, shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+def _decompile_one(src: Path, work_dir: Path, try_harder: bool) -> Tuple[Optional[Path], List[str]]:
+    import unrpyc as _unrpyc
+
+    dst_rpyc = work_dir / src.name
+    shutil.copyfile(src, dst_rpyc)
+
+    ctx = _unrpyc.Context()
+    try:
+        _unrpyc.decompile_rpyc(dst_rpyc, ctx, overwrite=True, try_harder=try_harder)
+    except Exception as e:
+        return None, [f"[unrpyc] error on {src.name}: {e!r}"]
+
+    out_text = dst_rpyc.with_suffix(".rpy")
+    return (out_text if out_text.exists() else None), list(ctx.log_contents)
+
+def _decompile_group(srcs: List[Path], work_dir: Path, try_harder: bool) -> List[Tuple[Optional[Path], List[str]]]:
+    # Files sharing a basename land on the same destination, so they run in
+    # input order within one worker and the last one wins.
+    return [_decompile_one(src, work_dir, try_harder) for src in srcs]
+
+def _new_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
 
 def decompile_rpyc_files(rpyc_files: List[Path], out_dir: Path, try_harder: bool = False) -> Tuple[List[Path], List[str]]:
     logs: List[str] = []
     produced: List[Path] = []
-
-    import unrpyc as _unrpyc
+    if not rpyc_files:
+        return produced, logs
 
     work_dir = out_dir / "decompiled"
     work_dir.mkdir(parents=True, exist_ok=True)
 
-    for src in rpyc_files:
-        dst_rpyc = work_dir / src.name
-        dst_rpyc.write_bytes(src.read_bytes())
+    groups: Dict[str, List[int]] = {}
+    for i, src in enumerate(rpyc_files):
+        groups.setdefault(src.name, []).append(i)
 
-        ctx = _unrpyc.Context()
+    results: List[Optional[Tuple[Optional[Path], List[str]]]] = [None] * len(rpyc_files)
+    crashed: List[List[int]] = []
+    with _new_pool(min(os.cpu_count() or 1, len(groups))) as pool:
+        futures = []
+        for g in groups.values():
+            try:
+                futures.append((g, pool.submit(_decompile_group, [rpyc_files[i] for i in g], work_dir, try_harder)))
+            except BrokenProcessPool:
+                crashed.append(g)
+        for g, fut in futures:
+            try:
+                for i, r in zip(g, fut.result()):
+                    results[i] = r
+            except BrokenProcessPool:
+                crashed.append(g)
+
+    # A crash takes down the whole pool, so unfinished groups are retried one
+    # file at a time in a fresh worker; a file that crashes again is skipped.
+    for g in crashed:
+        retry = None
         try:
-            _unrpyc.decompile_rpyc(dst_rpyc, ctx, overwrite=True, try_harder=try_harder)
-            logs.extend(ctx.log_contents)
-            out_text = dst_rpyc.with_suffix(".rpy")
-            if out_text.exists():
-                produced.append(out_text)
-        except Exception as e:
-            logs.append(f"[unrpyc] error on {src.name}: {e!r}")
+            for i in g:
+                src = rpyc_files[i]
+                if retry is None:
+                    retry = _new_pool(1)
+                try:
+                    results[i] = retry.submit(_decompile_one, src, work_dir, try_harder).result()
+                except BrokenProcessPool:
+                    results[i] = (None, [f"[unrpyc] worker crashed on {src.name}"])
+                    retry.shutdown(wait=True)
+                    retry = None
+        finally:
+            if retry is not None:
+                retry.shutdown(wait=True)
+
+    for out_text, l in results:
+        logs.extend(l)
+        if out_text is not None and out_text not in produced:
+            produced.append(out_text)
 
     return produced, logs
@@ -1,23 +1,59 @@
 from __future__ import annotations
+import json, os, sys
 from pathlib import Path
-from typing import List, Tuple
-from app.utils import run_cmd, which_any
+from typing import Dict, List, Tuple
+from app.utils import run_cmds_parallel, which_any
+
+UNRPA_BATCH = Path(__file__).with_name("unrpa_batch.py")
+
+def _log_cmd(logs: List[str], args: List[str], out: str, err: str) -> None:
+    logs.append(f"$ {' '.join(args)}")
+    if out.strip(): logs.append(out)
+    if err.strip(): logs.append(err)
 
 def extract_rpa_with_unrpa(archives: List[Path], out_dir: Path) -> Tuple[List[Path], List[str]]:
     logs: List[str] = []
     produced_dirs: List[Path] = []
 
+    targets: List[Path] = []
     for arc in archives:
         target = out_dir / f"rpa_extract/{arc.stem}"
         target.mkdir(parents=True, exist_ok=True)
+        targets.append(target)
+
+    # Same-target archives go to the same batch in input order so the last one
+    # wins; distinct targets are spread over one helper process per CPU.
+    by_target: Dict[Path, List[int]] = {}
+    for i, target in enumerate(targets):
+        by_target.setdefault(target, []).append(i)
+    n_batches = min(os.cpu_count() or 1, len(by_target))
+    batches: List[List[int]] = [[] for _ in range(n_batches)]
+    for k, indices in enumerate(by_target.values()):
+        batches[k % n_batches].extend(indices)
+    for batch in batches:
+        batch.sort()
+
+    args_list = [
+        [sys.executable, str(UNRPA_BATCH)] + [a for i in batch for a in (str(targets[i]), str(archives[i]))]
+        for batch in batches
+    ]
+    results = run_cmds_parallel(args_list, timeout_s=300 * max(len(b) for b in batches))
 
-        cmd = which_any(["unrpa"])
-        args = [cmd, "-m", "-p", str(target), str(arc)] if cmd else ["python", "-m", "unrpa", "-m", "-p", str(target), str(arc)]
+    status: Dict[int, Tuple[int, str]] = {}
+    for batch, args, (code, out, err) in zip(batches, args_list, results):
+        _log_cmd(logs, args, "", err)
+        for line in out.splitlines():
+            try:
+                rec = json.loads(line)
+                status[batch[rec["index"]]] = (int(rec["code"]), rec["error"])
+            except (ValueError, KeyError, IndexError, TypeError):
+                logs.append(line)
+        for i in batch:
+            status.setdefault(i, (code or 1, "no result from unrpa helper"))
 
-        code, out, err = run_cmd(args, timeout_s=300)
-        logs.append(f"$ {' '.join(args)}")
-        if out.strip(): logs.append(out)
-        if err.strip(): logs.append(err)
+    for i, (arc, target) in enumerate(zip(archives, targets)):
+        code, error = status[i]
+        if error.strip(): logs.append(f"[unrpa] {arc.name}: {error}")
         if code == 0:
             produced_dirs.append(target)
         else:
@@ -30,32 +66,38 @@ def extract_rpi_with_rpatool(rpi_files: List[Path], input_dir: Path, out_dir: Pa
     produced_dirs: List[Path] = []
     cmd = which_any(["rpatool"]) or "rpatool"
 
+    targets: List[Path] = []
     for rpi in rpi_files:
         target = out_dir / f"rpi_extract/{rpi.stem}"
         target.mkdir(parents=True, exist_ok=True)
-        tried: List[Path] = []
-
-        def _try_extract(archive: Path) -> int:
-            args = [cmd, "-o", str(target), "-x", str(archive)]
-            code, out, err = run_cmd(args, timeout_s=300)
-            logs.append(f"$ {' '.join(args)}")
-            if out.strip(): logs.append(out)
-            if err.strip(): logs.append(err)
-            return code
-
-        code = _try_extract(rpi)
-        tried.append(rpi)
-
-        if code != 0:
-            matching = input_dir / f"{rpi.stem}.rpa"
-            if matching.exists() and matching not in tried:
-                logs.append(f"[rpatool] .rpi extract failed; trying matching data archive: {matching.name}")
-                code = _try_extract(matching)
-                tried.append(matching)
+        targets.append(target)
 
-        if code == 0:
+    tried: List[List[Path]] = [[rpi] for rpi in rpi_files]
+    args_list = [[cmd, "-o", str(target), "-x", str(rpi)] for rpi, target in zip(rpi_files, targets)]
+    codes: List[int] = []
+    for args, (code, out, err) in zip(args_list, run_cmds_parallel(args_list, timeout_s=300, groups=targets)):
+        _log_cmd(logs, args, out, err)
+        codes.append(code)
+
+    retry: List[int] = []
+    for i, rpi in enumerate(rpi_files):
+        if codes[i] == 0:
+            continue
+        matching = input_dir / f"{rpi.stem}.rpa"
+        if matching.exists() and matching not in tried[i]:
+            logs.append(f"[rpatool] .rpi extract failed; trying matching data archive: {matching.name}")
+            tried[i].append(matching)
+            retry.append(i)
+
+    retry_args = [[cmd, "-o", str(targets[i]), "-x", str(tried[i][-1])] for i in retry]
+    for i, args, (code, out, err) in zip(retry, retry_args, run_cmds_parallel(retry_args, timeout_s=300, groups=[targets[i] for i in retry])):
+        _log_cmd(logs, args, out, err)
+        codes[i] = code
+
+    for i, target in enumerate(targets):
+        if codes[i] == 0:
             produced_dirs.append(target)
         else:
-            logs.append(f"[rpatool] failed ({code}) for {', '.join(p.name for p in tried)}")
+            logs.append(f"[rpatool] failed ({codes[i]}) for {', '.join(p.name for p in tried[i])}")
 
     return produced_dirs, logs
@@ -17,27 +17,13 @@ def pack_rpa_from_dir(
         logs.append(f"[pack] Source directory not found: {source_dir}")
         return None, logs
 
-    packroot = out_dir / "_packroot"
-    if packroot.exists():
-        import shutil
-        shutil.rmtree(packroot, ignore_errors=True)
-    packroot.mkdir(parents=True, exist_ok=True)
-
-    for src in source_dir.rglob("*"):
-        if src.is_dir():
-            continue
-        rel = src.relative_to(source_dir)
-        dst = packroot / rel
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        dst.write_bytes(src.read_bytes())
-
-    entries = [p.name for p in packroot.iterdir()]
-    if not entries:
+    out_path = out_dir.resolve() / archive_name
+    entries = sorted(p.name for p in source_dir.iterdir() if p != out_path)
+    if not any(p.is_file() and p != out_path for p in source_dir.rglob("*")):
         logs.append("[pack] Source directory is empty.")
         return None, logs
 
     cmd = which_any(["rpatool"]) or "rpatool"
-    out_path = out_dir / archive_name
     if out_path.exists():
         out_path.unlink(missing_ok=True)
 
@@ -49,8 +35,8 @@ def pack_rpa_from_dir(
 
     args: List[str] = [cmd, "-2" if int(version) == 2 else "-3", "-k", str(key_int), "-p", str(int(padding)), "-c", str(out_path)] + entries
 
-    code, out, err = run_cmd(args, cwd=packroot, timeout_s=300)
-    logs.append(f"$ (cwd={packroot}) {' '.join(args)}")
+    code, out, err = run_cmd(args, cwd=source_dir, timeout_s=300)
+    logs.append(f"$ (cwd={source_dir}) {' '.join(args)}")
     if out.strip(): logs.append(out)
     if err.strip(): logs.append(err)
 
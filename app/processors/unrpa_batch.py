@@ -0,0 +1,40 @@
+"""Extract several .rpa archives with unrpa in a single interpreter.
+
+Usage: python unrpa_batch.py TARGET ARCHIVE [TARGET ARCHIVE ...]
+
+Archives are extracted in the order given. One JSON line per archive is
+written to stdout: {"index": n, "code": 0|1, "error": "..."}.
+"""
+from __future__ import annotations
+import json, sys
+from typing import List
+
+def _emit(index: int, code: int, error: str) -> None:
+    print(json.dumps({"index": index, "code": code, "error": error}), flush=True)
+
+def main(argv: List[str]) -> int:
+    pairs = list(zip(argv[0::2], argv[1::2]))
+    try:
+        from unrpa import UnRPA
+        from unrpa.errors import UnRPAError
+    except ImportError as e:
+        for i in range(len(pairs)):
+            _emit(i, 1, f"unrpa is not installed: {e}")
+        return 1
+
+    rc = 0
+    for i, (target, archive) in enumerate(pairs):
+        try:
+            UnRPA(archive, path=target, mkdir=True).extract_files()
+        except UnRPAError as e:
+            _emit(i, 1, e.message)
+            rc = 1
+        except Exception as e:
+            _emit(i, 1, repr(e))
+            rc = 1
+        else:
+            _emit(i, 0, "")
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,17 @@
 from __future__ import annotations
-import os, re, shutil, subprocess, zipfile
-from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+import io, os, queue, shutil, subprocess, tarfile, threading, time, zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
 
-SAFE_PATH_RE = re.compile(r"^[a-zA-Z0-9_\-./]*$")
+SAFE_PATH_BYTES = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-./"
+
+TREE_CACHE_SIZE = 32
+_tree_cache: "OrderedDict[Tuple[str, int, int], list[dict]]" = OrderedDict()
+_tree_gen: dict[str, int] = {}
+_tree_lock = threading.Lock()
+_TREE_EPOCH = time.time_ns()
 
 def ensure_safe_relpath(p: str) -> str:
     if p is None:
@@ -11,7 +19,7 @@ def ensure_safe_relpath(p: str) -> str:
     p = p.strip()
     if p == "":
         raise ValueError("Invalid path")
-    if not SAFE_PATH_RE.match(p) or p.startswith("/") or ".." in Path(p).parts:
+    if p.encode("utf-8", "surrogatepass").translate(None, SAFE_PATH_BYTES) or p.startswith("/") or ".." in Path(p).parts:
         raise ValueError("Invalid path")
     return p
 
@@ -27,6 +35,13 @@ def which_any(names: Iterable[str]) -> Optional[str]:
             return p
     return None
 
+def fast_rmtree(p: Path) -> None:
+    if os.name == "posix" and shutil.which("rm"):
+        proc = subprocess.run(["rm", "-rf", "--", str(p)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        if proc.returncode == 0:
+            return
+    shutil.rmtree(p, ignore_errors=True)
+
 def run_cmd(args: List[str], cwd: Optional[Path] = None, timeout_s: int = 300) -> Tuple[int, str, str]:
     proc = subprocess.run(
         args,
@@ -38,38 +53,221 @@ def run_cmd(args: List[str], cwd: Optional[Path] = None, timeout_s: int = 300) -
     )
     return proc.returncode, proc.stdout, proc.stderr
 
+def run_cmds_parallel(
+    args_list: List[List[str]],
+    cwd: Optional[Path] = None,
+    timeout_s: int = 300,
+    max_parallel: Optional[int] = None,
+    groups: Optional[List[Hashable]] = None,
+) -> List[Tuple[int, str, str]]:
+    """Run commands concurrently; commands sharing a group key run in order in one slot."""
+    if not args_list:
+        return []
+    batches: Dict[Hashable, List[int]] = {}
+    for i, key in enumerate(groups if groups is not None else range(len(args_list))):
+        batches.setdefault(key, []).append(i)
+
+    results: List[Optional[Tuple[int, str, str]]] = [None] * len(args_list)
+
+    def run_batch(indices: List[int]) -> None:
+        for i in indices:
+            results[i] = run_cmd(args_list[i], cwd=cwd, timeout_s=timeout_s)
+
+    workers = min(max_parallel or os.cpu_count() or 1, len(batches))
+    if workers == 1:
+        for indices in batches.values():
+            run_batch(indices)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run_batch, batches.values()))
+    return results  # type: ignore[return-value]
+
 def is_zip_path(p: Path) -> bool:
     return p.suffix.lower() == ".zip"
 
 def extract_zip(zip_path: Path, out_dir: Path) -> None:
     with zipfile.ZipFile(zip_path, "r") as z:
-        out_root = out_dir.resolve()
         for info in z.infolist():
-            target = (out_dir / info.filename).resolve()
-            if not str(target).startswith(str(out_root)):
+            name = info.filename.replace("\\", "/")
+            if name.startswith("/") or ":" in name or ".." in PurePosixPath(name).parts:
                 raise ValueError("Unsafe ZIP entry detected")
         z.extractall(out_dir)
 
+class _ZipSink(io.RawIOBase):
+    """Unseekable write target that buffers ZIP output until drained."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip(root: Path, compression: int = zipfile.ZIP_STORED, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=compression) as z:
+        for f in root.rglob("*"):
+            if not f.is_file():
+                continue
+            info = zipfile.ZipInfo.from_file(f, arcname=str(f.relative_to(root)).replace(os.sep, "/"))
+            info.compress_type = compression
+            with f.open("rb") as src, z.open(info, "w", force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+class _ZstdQueueSink(io.RawIOBase):
+    """Write target that zstd-compresses tar output into a bounded queue."""
+
+    def __init__(self, comp, q: "queue.Queue[object]", stop: threading.Event) -> None:
+        self._comp = comp
+        self._q = q
+        self._stop = stop
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = self._comp.compress(bytes(b))
+        if data:
+            self.put(data)
+        return len(b)
+
+    def finish(self) -> None:
+        data = self._comp.flush()
+        if data:
+            self.put(data)
+
+    def put(self, item: object) -> None:
+        while not self._stop.is_set():
+            try:
+                self._q.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise OSError("tar.zst consumer went away")
+
+def iter_tar_zst(root: Path, level: int = 3) -> Iterator[bytes]:
+    import pyzstd
+
+    comp = pyzstd.ZstdCompressor({
+        pyzstd.CParameter.compressionLevel: level,
+        pyzstd.CParameter.nbWorkers: os.cpu_count() or 1,
+    })
+    q: "queue.Queue[object]" = queue.Queue(maxsize=8)
+    stop = threading.Event()
+    sink = _ZstdQueueSink(comp, q, stop)
+    done = object()
+
+    # tarfile only writes whole members, so it runs in a producer thread and
+    # the bounded queue keeps memory flat regardless of member size.
+    def produce() -> None:
+        try:
+            with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT, dereference=True) as tar:
+                for f in root.rglob("*"):
+                    if f.is_file():
+                        tar.add(f, arcname=str(f.relative_to(root)).replace(os.sep, "/"), recursive=False)
+            sink.finish()
+            result: object = done
+        except BaseException as e:
+            result = e
+        try:
+            sink.put(result)
+        except OSError:
+            pass
+
+    threading.Thread(target=produce, name="tar-zst", daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def invalidate_tree(root: Path) -> None:
+    key = str(root.resolve())
+    with _tree_lock:
+        _tree_gen[key] = _tree_gen.get(key, 0) + 1
+
+def forget_tree(root: Path) -> None:
+    key = str(root.resolve())
+    with _tree_lock:
+        _tree_gen.pop(key, None)
+        for k in [k for k in _tree_cache if k[0] == key]:
+            del _tree_cache[k]
+
+def tree_etag(root: Path) -> str:
+    rk = str(root.resolve())
+    st = os.stat(rk)
+    with _tree_lock:
+        gen = _tree_gen.get(rk, 0)
+    return f'W/"{_TREE_EPOCH:x}-{st.st_mtime_ns:x}-{gen:x}"'
+
+def file_etag(st: os.stat_result) -> str:
+    return f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
 def walk_tree(root: Path) -> list[dict]:
     root = root.resolve()
+    rk = str(root)
+    with _tree_lock:
+        key = (rk, os.stat(rk).st_mtime_ns, _tree_gen.get(rk, 0))
+        cached = _tree_cache.get(key)
+        if cached is not None:
+            _tree_cache.move_to_end(key)
+            return cached
 
-    def node_for_dir(d: Path) -> dict:
-        children = []
-        for p in sorted(d.iterdir(), key=lambda x: (x.is_file(), x.name.lower())):
-            if p.is_dir():
-                children.append(node_for_dir(p))
+    tree = _walk_tree_uncached(root)
+    with _tree_lock:
+        _tree_cache[key] = tree
+        while len(_tree_cache) > TREE_CACHE_SIZE:
+            _tree_cache.popitem(last=False)
+    return tree
+
+def _walk_tree_uncached(root: Path) -> list[dict]:
+    top = {"type": "dir", "name": "/", "path": "", "children": []}
+
+    stack = [(str(root), top)]
+    while stack:
+        d, node = stack.pop()
+        with os.scandir(d) as it:
+            entries = sorted(it, key=lambda e: (e.is_file(), e.name.lower()))
+        prefix = node["path"] + "/" if node["path"] else ""
+        children = node["children"]
+        for e in entries:
+            rel = prefix + e.name
+            if e.is_dir():
+                child = {"type": "dir", "name": e.name, "path": rel, "children": []}
+                stack.append((e.path, child))
             else:
-                children.append({
+                child = {
                     "type": "file",
-                    "name": p.name,
-                    "path": str(p.relative_to(root)).replace(os.sep, "/"),
-                    "size": p.stat().st_size,
-                })
-        return {
-            "type": "dir",
-            "name": d.name if d != root else "/",
-            "path": str(d.relative_to(root)).replace(os.sep, "/") if d != root else "",
-            "children": children,
-        }
-
-    return [node_for_dir(root)]
+                    "name": e.name,
+                    "path": rel,
+                    "size": e.stat().st_size,
+                }
+            children.append(child)
+
+    return [top]